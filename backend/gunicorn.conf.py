@@ -0,0 +1,18 @@
+import multiprocessing
+
+# Production server config: one uvicorn event loop per core instead of the
+# single-process dev server. preload_app imports the application once in the
+# master so the workers share the imported modules via copy-on-write; the
+# services and their DB connections are created lazily per worker, so nothing
+# crosses the fork. Run with:  gunicorn -c gunicorn.conf.py main:app
+bind = "0.0.0.0:8000"
+workers = multiprocessing.cpu_count()
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
+graceful_timeout = 30
+
+# The in-process response cache can't see invalidations performed by other
+# workers, so it must stay off whenever more than one worker runs. Export a
+# shared-cache configuration (e.g. Redis-backed) before re-enabling it here.
+raw_env = ["RESPONSE_CACHE_TTL=0"]
@@ -1,69 +1,179 @@
+import asyncio
+import fcntl
+import hashlib
 import os
 import json
+import re
 import uuid
 import logging
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Optional, List, Dict
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse, RedirectResponse
+import aiofiles
+import orjson
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response, BackgroundTasks, Depends
+from fastapi.responses import ORJSONResponse, RedirectResponse, FileResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.exceptions import RequestValidationError
-from pydantic import BaseModel
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ConfigDict
 
 from services.workflow_service import WorkflowService
 from services.knowledge_base_service import KnowledgeBaseService
+from services.response_cache import ResponseCache
 from models import ItemApprovalRequest
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def _init_storage():
+    """Runs the schema DDL and creates the upload/results directories.
+
+    Guarded by a file lock so that when several workers boot against the
+    same SQLite file, only one of them executes the CREATE TABLE statements.
+    """
+    from models import init_db
+    workflow_service = get_workflow_service()
+    with open('.init.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        init_db()
+        os.makedirs(workflow_service.upload_dir, exist_ok=True)
+        os.makedirs(workflow_service.results_dir, exist_ok=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initializes the database and creates directories on startup."""
+    await asyncio.to_thread(_init_storage)
+    yield
+
+class SafeRoute(APIRoute):
+    """Route class that turns unhandled endpoint exceptions into HTTP 500s.
+
+    Keeps the per-endpoint try/except boilerplate out of the handlers:
+    HTTPExceptions pass through untouched, anything else is logged with its
+    traceback and surfaced as a 500.
+    """
+    def get_route_handler(self):
+        original = super().get_route_handler()
+
+        async def handler(request: Request):
+            try:
+                return await original(request)
+            except (HTTPException, RequestValidationError):
+                # Let FastAPI's own handlers produce the 4xx responses.
+                raise
+            except Exception as e:
+                logging.exception("Unhandled error handling %s", request.url.path)
+                raise HTTPException(status_code=500, detail=str(e))
+
+        return handler
+
 app = FastAPI(
     title="BOM Platform API",
     description="Backend API for the autonomous BOM processing platform with Gemini integration.",
     version="4.2.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
+app.router.route_class = SafeRoute
 
-# Configure CORS
-origins = ["*"]
+# Configure CORS. A concrete origin list (instead of "*") lets the
+# middleware emit a static Access-Control-Allow-Origin header, and the
+# narrowed methods/headers let it precompute the preflight response once.
+origins = [o for o in os.environ.get("CORS_ORIGINS", "http://localhost:3000").split(",") if o]
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_credentials=False,
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
+# Compress responses over 1 KiB; the workflow and knowledge-base payloads are
+# repetitive JSON that typically shrinks 5-10x. Tiny responses are left alone
+# so the compression overhead never exceeds the transfer saving.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Chunk size for streaming uploads to disk (1 MiB keeps memory bounded
+# regardless of how large the uploaded document is).
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+async def save_upload_to_disk(upload: UploadFile, dest_path: str) -> str:
+    """Streams an UploadFile to disk in fixed-size chunks and returns the path."""
+    async with aiofiles.open(dest_path, 'wb') as out_file:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            await out_file.write(chunk)
+    return dest_path
+
 class URLUploadRequest(BaseModel):
     url: str
     workflow_name: str
 
+class WorkflowSummary(BaseModel):
+    # Concrete field types keep validation on pydantic-core's fast path;
+    # extra='allow' preserves any additional keys the workflow attaches.
+    model_config = ConfigDict(extra='allow')
+
+    total_materials: int = 0
+    successful_matches: int = 0
+    knowledge_base_matches: int = 0
+    comparison_mode: str = 'full'
+
 class UpdateResultsRequest(BaseModel):
+    # Match rows are free-form LLM output, so they stay as dicts.
     matches: List[Dict]
-    summary: Dict
+    summary: WorkflowSummary
 
 # Add a custom exception handler for validation errors to get detailed logs
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    logging.error(f"Validation Error: {exc.errors()} for request to {request.url}")
-    return JSONResponse(
+    logging.error("Validation Error: %s for request to %s", exc.errors(), request.url)
+    return ORJSONResponse(
         status_code=422,
         content={"detail": exc.errors()}
     )
 
-@app.on_event("startup")
-async def startup_event():
-    """Initializes the database and creates directories on startup."""
-    try:
-        from models import init_db
-        init_db()
-        os.makedirs(workflow_service.upload_dir, exist_ok=True)
-        os.makedirs(workflow_service.results_dir, exist_ok=True)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Server startup failed: {e}")
-
-# Initialize services
-workflow_service = WorkflowService()
-kb_service = KnowledgeBaseService()
+# Service singletons, constructed lazily on first use so import has no
+# side effects (DB engine creation happens after the lifespan init ran).
+@lru_cache(maxsize=1)
+def get_workflow_service() -> WorkflowService:
+    return WorkflowService()
+
+@lru_cache(maxsize=1)
+def get_kb_service() -> KnowledgeBaseService:
+    return KnowledgeBaseService()
+
+# Short-TTL caches for the polled GET endpoints; write endpoints clear the
+# namespace they touch. Both the cache and its invalidation are per-process,
+# so this is only safe single-process: the multi-worker Gunicorn config sets
+# RESPONSE_CACHE_TTL=0 to disable it (other workers would otherwise serve
+# stale payloads for up to the TTL after a write they didn't handle).
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "10"))
+workflows_cache = ResponseCache(ttl_seconds=RESPONSE_CACHE_TTL)
+kb_cache = ResponseCache(ttl_seconds=RESPONSE_CACHE_TTL)
+
+# Knowledge-base requests above this size are streamed row by row instead of
+# materialized and cached; below it the dashboard-polling cache wins.
+KB_STREAM_THRESHOLD = 200
+
+# Compiled once so classifying a large batch doesn't lower-case and scan each
+# filename in Python; the C-level regex search does the case folding.
+_WI_RE = re.compile(r"wi", re.IGNORECASE)
+
+async def _stream_kb_items(items_iter, stats):
+    """Yields the knowledge-base payload as incremental JSON fragments."""
+    yield b'{"success":true,"stats":' + orjson.dumps(stats) + b',"items":['
+    first = True
+    async for item in iterate_in_threadpool(items_iter):
+        if not first:
+            yield b','
+        first = False
+        yield orjson.dumps(item)
+    yield b']}'
 
 # --- Cloud Authentication Endpoints ---
 
@@ -78,7 +188,7 @@ async def auth_sharepoint_start():
     # app = ConfidentialClientApplication(client_id, authority=authority, client_credential=secret)
     # auth_url = app.get_authorization_request_url(scopes)
     # return RedirectResponse(auth_url)
-    return JSONResponse(content={"message": "SharePoint auth flow starts here. Redirect to Microsoft login."})
+    return {"message": "SharePoint auth flow starts here. Redirect to Microsoft login."}
 
 @app.get("/api/auth/gdrive/start")
 async def auth_gdrive_start():
@@ -91,190 +201,207 @@ async def auth_gdrive_start():
     # flow = Flow.from_client_secrets_file('client_secrets.json', scopes=scopes)
     # authorization_url, state = flow.authorization_url()
     # return RedirectResponse(authorization_url)
-    return JSONResponse(content={"message": "Google Drive auth flow starts here. Redirect to Google login."})
+    return {"message": "Google Drive auth flow starts here. Redirect to Google login."}
 
 
 @app.get("/api/workflows")
-async def get_workflows():
+async def get_workflows(workflow_service: WorkflowService = Depends(get_workflow_service)):
     """Get all workflows from the database."""
-    try:
-        workflows = workflow_service.get_all_workflows()
-        return JSONResponse(content={'success': True, 'workflows': workflows})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    cached = workflows_cache.get('all')
+    if cached is not None:
+        return cached
+    payload = {'success': True, 'workflows': await asyncio.to_thread(workflow_service.get_all_workflows)}
+    workflows_cache.set('all', payload)
+    return payload
 
 @app.delete("/api/workflows/{workflow_id}")
-async def delete_workflow(workflow_id: str):
+async def delete_workflow(workflow_id: str, workflow_service: WorkflowService = Depends(get_workflow_service)):
     """Deletes a workflow and all associated data."""
-    try:
-        workflow_service.delete_workflow(workflow_id)
-        return JSONResponse(content={'success': True, 'message': f'Workflow {workflow_id} deleted successfully'})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    await asyncio.to_thread(workflow_service.delete_workflow, workflow_id)
+    workflows_cache.clear()
+    return {'success': True, 'message': f'Workflow {workflow_id} deleted successfully'}
 
 @app.get("/api/knowledge-base")
-async def get_knowledge_base(search: Optional[str] = "", limit: int = 50):
+async def get_knowledge_base(search: Optional[str] = "", limit: int = 50, kb_service: KnowledgeBaseService = Depends(get_kb_service)):
     """Get knowledge base items with statistics, with optional search."""
-    try:
-        items = kb_service.get_items(search, limit)
-        stats = kb_service.get_stats()
-        return JSONResponse(content={'success': True, 'items': items, 'stats': stats})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    if limit > KB_STREAM_THRESHOLD:
+        # Large dumps: stream rows straight from the cursor so the first
+        # byte goes out immediately and memory stays bounded.
+        stats = await asyncio.to_thread(kb_service.get_stats)
+        return StreamingResponse(
+            _stream_kb_items(kb_service.iter_items(search, limit), stats),
+            media_type="application/json"
+        )
+    cached = kb_cache.get(('items', search, limit))
+    if cached is not None:
+        return cached
+    items = await asyncio.to_thread(kb_service.get_items, search, limit)
+    stats = await asyncio.to_thread(kb_service.get_stats)
+    payload = {'success': True, 'items': items, 'stats': stats}
+    kb_cache.set(('items', search, limit), payload)
+    return payload
 
 @app.get("/api/knowledge-base/pending")
-async def get_pending_approvals():
+async def get_pending_approvals(kb_service: KnowledgeBaseService = Depends(get_kb_service)):
     """Get pending items for approval."""
-    try:
-        pending_items = kb_service.get_pending_approvals()
-        return JSONResponse(content={'success': True, 'pending_items': pending_items})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    cached = kb_cache.get('pending')
+    if cached is not None:
+        return cached
+    payload = {'success': True, 'pending_items': await asyncio.to_thread(kb_service.get_pending_approvals)}
+    kb_cache.set('pending', payload)
+    return payload
 
 @app.post("/api/knowledge-base/approve")
-async def approve_knowledge_base_item(request: ItemApprovalRequest):
+async def approve_knowledge_base_item(request: ItemApprovalRequest, kb_service: KnowledgeBaseService = Depends(get_kb_service)):
     """Approve an item for the knowledge base."""
-    try:
-        logging.info(f"Received approval request for items: {request.item_ids} from workflow: {request.workflow_id}")
-        result = kb_service.approve_items(request.item_ids)
-        return JSONResponse(content={'success': True, 'approved_count': result})
-    except Exception as e:
-        logging.error(f"Error approving items: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    logging.info("Received approval request for items: %s from workflow: %s", request.item_ids, request.workflow_id)
+    result = await asyncio.to_thread(kb_service.approve_items, request.item_ids)
+    kb_cache.clear()
+    return {'success': True, 'approved_count': result}
 
 @app.post("/api/knowledge-base/reject")
-async def reject_knowledge_base_item(request: ItemApprovalRequest):
+async def reject_knowledge_base_item(request: ItemApprovalRequest, kb_service: KnowledgeBaseService = Depends(get_kb_service)):
     """Reject an item from the knowledge base."""
-    try:
-        logging.info(f"Received rejection request for items: {request.item_ids} from workflow: {request.workflow_id}")
-        result = kb_service.reject_items(request.item_ids)
-        return JSONResponse(content={'success': True, 'rejected_count': result})
-    except Exception as e:
-        logging.error(f"Error rejecting items: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    logging.info("Received rejection request for items: %s from workflow: %s", request.item_ids, request.workflow_id)
+    result = await asyncio.to_thread(kb_service.reject_items, request.item_ids)
+    kb_cache.clear()
+    return {'success': True, 'rejected_count': result}
 
 @app.delete("/api/knowledge-base/{item_id}")
-async def delete_knowledge_base_item(item_id: int):
+async def delete_knowledge_base_item(item_id: int, kb_service: KnowledgeBaseService = Depends(get_kb_service)):
     """Delete an item from the knowledge base."""
-    try:
-        kb_service.delete_item(item_id)
-        return JSONResponse(content={'success': True, 'message': 'Item deleted successfully'})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    await asyncio.to_thread(kb_service.delete_item, item_id)
+    kb_cache.clear()
+    return {'success': True, 'message': 'Item deleted successfully'}
 
 @app.post("/api/autonomous/upload")
 async def upload_documents(
+    background_tasks: BackgroundTasks,
     wi_document: UploadFile = File(..., description="The WI/QC document to process."),
     workflow_name: str = Form(..., description="A user-defined name for the workflow."),
     item_master: Optional[UploadFile] = File(None, description="Optional Item Master for full comparison mode."),
-    comparison_mode: str = Form(..., description="'full' or 'kb_only'")
+    comparison_mode: str = Form(..., description="'full' or 'kb_only'"),
+    workflow_service: WorkflowService = Depends(get_workflow_service)
 ):
     """Handles single document upload with a user-defined workflow name."""
-    try:
-        if not wi_document:
-            raise HTTPException(status_code=400, detail="WI document is required")
-
-        if comparison_mode == 'full' and not item_master:
-            raise HTTPException(status_code=400, detail="Item Master is required for full comparison mode")
-
-        workflow_id = str(uuid.uuid4())
-
-        # Start processing asynchronously
-        workflow_service.start_workflow(
-            workflow_id=workflow_id,
-            workflow_name=workflow_name,
-            wi_document=wi_document,
-            item_master=item_master,
-            comparison_mode=comparison_mode
-        )
+    if not wi_document:
+        raise HTTPException(status_code=400, detail="WI document is required")
+
+    if comparison_mode == 'full' and not item_master:
+        raise HTTPException(status_code=400, detail="Item Master is required for full comparison mode")
+
+    workflow_id = uuid.uuid4().hex
+
+    # Stream the uploads to disk so memory usage stays bounded even for
+    # multi-MB documents, then hand the worker plain file paths.
+    workflow_dir = os.path.join(workflow_service.upload_dir, workflow_id)
+    os.makedirs(workflow_dir, exist_ok=True)
+
+    wi_path = await save_upload_to_disk(wi_document, os.path.join(workflow_dir, wi_document.filename))
+
+    item_master_path = None
+    if item_master:
+        item_master_path = await save_upload_to_disk(item_master, os.path.join(workflow_dir, item_master.filename))
+
+    # Kick off processing after the response is sent so the client gets
+    # its workflow_id immediately instead of waiting on the DB insert.
+    background_tasks.add_task(
+        workflow_service.start_workflow,
+        workflow_id=workflow_id,
+        workflow_name=workflow_name,
+        wi_path=wi_path,
+        item_master_path=item_master_path,
+        comparison_mode=comparison_mode
+    )
 
-        return JSONResponse(content={
-            'success': True,
-            'workflow_id': workflow_id,
-            'message': 'Processing started successfully'
-        })
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to start workflow: {str(e)}")
+    return {
+        'success': True,
+        'workflow_id': workflow_id,
+        'message': 'Processing started successfully'
+    }
 
 @app.post("/api/autonomous/upload_from_url")
-async def upload_from_url(request: URLUploadRequest):
+async def upload_from_url(request: URLUploadRequest, background_tasks: BackgroundTasks, workflow_service: WorkflowService = Depends(get_workflow_service)):
     """
     Handles document processing from a cloud storage URL (Sharepoint, GDrive).
     This endpoint simulates downloading files and starting batch workflows.
     """
-    try:
-        # In a real implementation, you would use a cloud-specific SDK
-        # to authenticate and download the files from the provided URL.
-        # This is a placeholder for that logic.
-        downloaded_files = workflow_service.download_files_from_cloud(request.url)
-
-        if not downloaded_files:
-            raise HTTPException(status_code=400, detail="Could not retrieve files from the provided URL.")
-
-        workflow_ids = []
-        # Process each downloaded file as a separate workflow
-        for file_info in downloaded_files:
-            workflow_id = str(uuid.uuid4())
-            
-            # Here we are simulating the file objects that FastAPI creates
-            class MockUploadFile:
-                def __init__(self, filename, file_path):
-                    self.filename = filename
-                    self.file = open(file_path, 'rb')
-
-            wi_doc = MockUploadFile(file_info['filename'], file_info['path'])
-
-            # Determine workflow type based on filename
-            workflow_type = "WI" if "wi" in file_info['filename'].lower() else "QC"
-            workflow_name = f"{request.workflow_name} - {workflow_type} - {file_info['filename']}"
-
-            workflow_service.start_workflow(
-                workflow_id=workflow_id,
-                workflow_name=workflow_name,
-                wi_document=wi_doc,
-                comparison_mode='kb_only' # Assuming kb_only for batch processing
-            )
-            workflow_ids.append(workflow_id)
-
-        return JSONResponse(content={
-            'success': True,
-            'workflow_ids': workflow_ids,
-            'message': f'Started batch processing for {len(workflow_ids)} documents.'
-        })
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to start batch workflow: {str(e)}")
+    # In a real implementation, you would use a cloud-specific SDK
+    # to authenticate and download the files from the provided URL.
+    # This is a placeholder for that logic; the files in the batch are
+    # downloaded concurrently rather than one after another.
+    downloaded_files = await workflow_service.download_files_from_cloud_async(request.url)
+
+    if not downloaded_files:
+        raise HTTPException(status_code=400, detail="Could not retrieve files from the provided URL.")
+
+    workflow_ids = []
+    # Process each downloaded file as a separate workflow
+    for file_info in downloaded_files:
+        workflow_id = uuid.uuid4().hex
+
+        # Determine workflow type based on filename
+        workflow_type = "WI" if _WI_RE.search(file_info.filename) else "QC"
+        workflow_name = f"{request.workflow_name} - {workflow_type} - {file_info.filename}"
+
+        # The file is already on disk, so just hand the worker its path.
+        # All workflow_ids are created up front and the actual processing
+        # is enqueued, so the response does not wait on N DB inserts.
+        background_tasks.add_task(
+            workflow_service.start_workflow,
+            workflow_id=workflow_id,
+            workflow_name=workflow_name,
+            wi_path=file_info.path,
+            comparison_mode='kb_only' # Assuming kb_only for batch processing
+        )
+        workflow_ids.append(workflow_id)
+
+    return {
+        'success': True,
+        'workflow_ids': workflow_ids,
+        'message': f'Started batch processing for {len(workflow_ids)} documents.'
+    }
 
 
 @app.get("/api/autonomous/workflow/{workflow_id}/status")
-async def get_workflow_status(workflow_id: str):
+async def get_workflow_status(workflow_id: str, request: Request, workflow_service: WorkflowService = Depends(get_workflow_service)):
     """Get workflow status."""
     try:
-        status = workflow_service.get_workflow_status(workflow_id)
-        return JSONResponse(content=status)
-    except Exception as e:
+        status = await asyncio.to_thread(workflow_service.get_workflow_status, workflow_id)
+    except ValueError as e:
         raise HTTPException(status_code=404, detail=f"Workflow not found: {str(e)}")
+    # Frontends poll this endpoint every second and most responses are
+    # byte-identical to the last one, so honor If-None-Match with a 304
+    # that carries no body.
+    etag = hashlib.md5(orjson.dumps(status)).hexdigest()
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304)
+    return ORJSONResponse(status, headers={'ETag': etag})
 
 @app.get("/api/autonomous/workflow/{workflow_id}/results")
-async def get_workflow_results(workflow_id: str):
+async def get_workflow_results(workflow_id: str, workflow_service: WorkflowService = Depends(get_workflow_service)):
     """Get workflow results."""
+    results_path = workflow_service.get_results_file_path(workflow_id)
+    if results_path:
+        # Results are already JSON on disk; stream the file bytes instead
+        # of loading and re-serializing the whole payload.
+        return FileResponse(results_path, media_type='application/json')
     try:
-        results = workflow_service.get_workflow_results(workflow_id)
-        return JSONResponse(content=results)
-    except Exception as e:
+        results = await asyncio.to_thread(workflow_service.get_workflow_results, workflow_id)
+    except ValueError as e:
         raise HTTPException(status_code=404, detail=f"Results not found: {str(e)}")
+    return results
 
 @app.post("/api/autonomous/workflow/{workflow_id}/results")
-async def update_workflow_results(workflow_id: str, request: UpdateResultsRequest):
+async def update_workflow_results(workflow_id: str, request: UpdateResultsRequest, workflow_service: WorkflowService = Depends(get_workflow_service)):
     """Update workflow results after user edits."""
-    try:
-        workflow_service.update_workflow_results(workflow_id, request.dict())
-        return JSONResponse(content={'success': True, 'message': 'Results updated successfully'})
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to update results: {str(e)}")
+    await asyncio.to_thread(workflow_service.update_workflow_results, workflow_id, request.model_dump())
+    return {'success': True, 'message': 'Results updated successfully'}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Ask for the uvloop event loop and httptools parser explicitly so a bare
+    # uvicorn install fails loudly instead of silently falling back to the
+    # pure-Python asyncio loop and h11 parser.
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
 
@@ -7,16 +7,28 @@ from typing import List, Optional
 
 DB_PATH = 'bom_platform.db'
 
-def get_db_connection():
+def get_db_connection(check_same_thread=True):
     """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
+    # A larger statement cache lets sqlite3 reuse prepared statements for the
+    # handful of queries this app repeats on every request instead of
+    # re-parsing the SQL text each time.
+    conn = sqlite3.connect(DB_PATH, cached_statements=128,
+                           check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    # Safe with WAL journaling (set once in init_db): fsync on checkpoint
+    # rather than on every transaction.
+    conn.execute('PRAGMA synchronous = NORMAL')
     return conn
 
 def init_db():
     """Initialize database with all tables"""
     conn = get_db_connection()
-    
+
+    # WAL is persistent, so setting it once here covers all later
+    # connections. It allows readers to proceed while a writer commits,
+    # which matters because status polling and workflow updates overlap.
+    conn.execute('PRAGMA journal_mode = WAL')
+
     conn.execute('''
         CREATE TABLE IF NOT EXISTS workflows (
             id TEXT PRIMARY KEY,
@@ -186,6 +198,42 @@ class KnowledgeBaseModel:
         conn.close()
         return [dict(item) for item in items]
     
+    @staticmethod
+    def iter_items(query='', limit=50, batch_size=500):
+        """Yields knowledge base rows as dicts, fetching in batches.
+
+        Unlike search_items this never materializes the full result set,
+        so callers can stream arbitrarily large dumps with bounded memory.
+        """
+        # The streaming endpoint resumes this generator from a thread pool,
+        # so successive next() calls can land on different threads than the
+        # one that opened the connection. That handoff is safe — rows are
+        # consumed strictly sequentially and CPython builds sqlite3 in
+        # serialized mode — but requires disabling the same-thread check.
+        conn = get_db_connection(check_same_thread=False)
+        try:
+            if query:
+                cursor = conn.execute('''
+                    SELECT * FROM knowledge_base
+                    WHERE material_name LIKE ? OR part_number LIKE ? OR description LIKE ?
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                ''', (f'%{query}%', f'%{query}%', f'%{query}%', limit))
+            else:
+                cursor = conn.execute('''
+                    SELECT * FROM knowledge_base
+                    ORDER BY created_at DESC
+                    LIMIT ?
+                ''', (limit,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+
     @staticmethod
     def get_stats():
         conn = get_db_connection()
@@ -14,6 +14,10 @@ class KnowledgeBaseService:
         """Get knowledge base items"""
         return KnowledgeBaseModel.search_items(search_query, limit)
     
+    def iter_items(self, search_query='', limit=50):
+        """Iterate over knowledge base items without loading them all at once"""
+        return KnowledgeBaseModel.iter_items(search_query, limit)
+
     def get_stats(self):
         """Get knowledge base statistics"""
         return KnowledgeBaseModel.get_stats()
@@ -0,0 +1,50 @@
+import time
+import threading
+
+class ResponseCache:
+    """
+    A small in-process TTL cache for GET endpoint payloads.
+
+    Dashboards poll the workflow and knowledge-base endpoints every few
+    seconds, so most reads are identical within a short window. Caching the
+    assembled payload for a few seconds drops the database query rate to
+    roughly (unique queries / TTL) while write endpoints invalidate their
+    namespace so stale data is never served after a mutation.
+
+    The cache (and its invalidation) is per-process: in a multi-worker
+    deployment a write only clears the worker that handled it, so other
+    workers would serve stale data for up to the TTL. Construct with
+    ttl_seconds <= 0 to disable caching entirely in that case; a shared
+    backend such as Redis would be needed to cache safely across workers.
+    """
+
+    def __init__(self, ttl_seconds: float = 10.0):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached value for key, or None if missing/expired."""
+        if self.ttl_seconds <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        """Caches value under key for the configured TTL."""
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+
+    def clear(self):
+        """Drops all entries, e.g. after a write that affects this namespace."""
+        with self._lock:
+            self._entries.clear()
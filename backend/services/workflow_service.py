@@ -1,12 +1,13 @@
+import asyncio
 import os
 import json
 import shutil
-import threading
+from dataclasses import dataclass
+
+import aiofiles
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
 import logging
-from typing import Optional, List, Dict
-import uuid
+from typing import List, Dict
 
 # Import all services and models
 from models import WorkflowModel, PendingApprovalModel, KnowledgeBaseModel
@@ -18,6 +19,16 @@ from services.document_parser import DocumentParser
 executor = ThreadPoolExecutor(max_workers=4)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+@dataclass(slots=True, frozen=True)
+class FileInfo:
+    """A file retrieved from cloud storage.
+
+    slots keeps per-instance memory low and makes attribute access a fixed
+    offset load, which matters when a batch scan returns thousands of files.
+    """
+    filename: str
+    path: str
+
 class WorkflowService:
     """
     Main service for orchestrating the BOM processing workflow.
@@ -31,35 +42,21 @@ class WorkflowService:
         self.kb_service = KnowledgeBaseService(gemini_service=self.gemini_service)
         self.doc_parser = DocumentParser()
 
-    def start_workflow(self, workflow_id, workflow_name, wi_document, item_master=None, comparison_mode='full'):
+    def start_workflow(self, workflow_id, workflow_name, wi_path, item_master_path=None, comparison_mode='full'):
         """
         Initializes and starts an asynchronous workflow.
+
+        The caller is responsible for having the documents on disk already
+        (e.g. streamed there by the upload endpoint); this method only records
+        the workflow and schedules processing against the given paths.
         """
         try:
-            workflow_dir = os.path.join(self.upload_dir, workflow_id)
-            os.makedirs(workflow_dir, exist_ok=True)
-            
-            wi_path = os.path.join(workflow_dir, wi_document.filename)
-            # Handle cases where wi_document is a real file or a mock object
-            if hasattr(wi_document.file, 'read'):
-                with open(wi_path, "wb") as buffer:
-                    shutil.copyfileobj(wi_document.file, buffer)
-            else:
-                 shutil.copy(wi_document.file.name, wi_path)
-
+            WorkflowModel.create_workflow(workflow_id, workflow_name, comparison_mode, wi_path, item_master_path)
+            executor.submit(self._process_workflow_async, workflow_id, wi_path, item_master_path, comparison_mode)
 
-            item_path = None
-            if item_master:
-                item_path = os.path.join(workflow_dir, item_master.filename)
-                with open(item_path, "wb") as buffer:
-                    shutil.copyfileobj(item_master.file, buffer)
-            
-            WorkflowModel.create_workflow(workflow_id, workflow_name, comparison_mode, wi_path, item_path)
-            executor.submit(self._process_workflow_async, workflow_id, wi_path, item_path, comparison_mode)
-            
             return True
         except Exception as e:
-            logging.error(f"Failed to start workflow: {str(e)}")
+            logging.error("Failed to start workflow: %s", e)
             raise Exception(f"Failed to start workflow: {str(e)}")
 
     def _process_workflow_async(self, workflow_id, wi_path, item_path, comparison_mode):
@@ -76,7 +73,7 @@ class WorkflowService:
             item_master_items = self.doc_parser.parse_item_master(item_path, self.gemini_service) if item_path else []
             kb_items = self.kb_service.get_items()
             
-            logging.info(f"Workflow {workflow_id}: Document content extracted.")
+            logging.info("Workflow %s: Document content extracted.", workflow_id)
 
             WorkflowModel.update_workflow_status(
                 workflow_id, 'processing', progress=30, 
@@ -84,7 +81,7 @@ class WorkflowService:
             )
             
             translated_wi_content = self.translation_service.translate_to_english(wi_content)
-            logging.info(f"Workflow {workflow_id}: Document translated.")
+            logging.info("Workflow %s: Document translated.", workflow_id)
 
             WorkflowModel.update_workflow_status(
                 workflow_id, 'processing', progress=50, 
@@ -98,7 +95,7 @@ class WorkflowService:
                 kb_items_content=json.dumps(kb_items, indent=2)
             )
             
-            logging.info(f"Workflow {workflow_id}: Gemini agent completed. Extracted {len(extracted_items)} items.")
+            logging.info("Workflow %s: Gemini agent completed. Extracted %d items.", workflow_id, len(extracted_items))
             
             # Deduplicate items before further processing
             deduplicated_items = self._deduplicate_items(extracted_items)
@@ -115,12 +112,12 @@ class WorkflowService:
             # Process auto-register items
             if items_to_auto_register:
                 self._add_to_knowledge_base(workflow_id, items_to_auto_register)
-                logging.info(f"Workflow {workflow_id}: Auto-registered {len(items_to_auto_register)} items.")
+                logging.info("Workflow %s: Auto-registered %d items.", workflow_id, len(items_to_auto_register))
 
             # Create pending approvals for human review items
             if items_for_human_review:
                 self._create_pending_approvals(workflow_id, items_for_human_review)
-                logging.info(f"Workflow {workflow_id}: Created {len(items_for_human_review)} pending approvals.")
+                logging.info("Workflow %s: Created %d pending approvals.", workflow_id, len(items_for_human_review))
             
             summary = self._generate_summary(deduplicated_items, comparison_mode)
             self._save_workflow_results(workflow_id, deduplicated_items, summary)
@@ -134,7 +131,7 @@ class WorkflowService:
             WorkflowModel.update_workflow_status(
                 workflow_id, 'error', message=f'Processing failed: {str(e)}'
             )
-            logging.error(f"Workflow {workflow_id} failed with error: {e}")
+            logging.error("Workflow %s failed with error: %s", workflow_id, e)
 
     def _deduplicate_items(self, items: List[Dict]) -> List[Dict]:
         """
@@ -216,11 +213,17 @@ class WorkflowService:
             raise ValueError("Workflow not found")
         return workflow
     
+    def get_results_file_path(self, workflow_id):
+        """Returns the on-disk results file path, or None if it doesn't exist."""
+        results_file = os.path.join(self.results_dir, f'{workflow_id}.json')
+        return results_file if os.path.exists(results_file) else None
+
     def get_workflow_results(self, workflow_id):
         results_file = os.path.join(self.results_dir, f'{workflow_id}.json')
         if not os.path.exists(results_file):
             # Fallback to database
-            conn = WorkflowModel.get_db_connection()
+            from models import get_db_connection
+            conn = get_db_connection()
             result_row = conn.execute('SELECT results_data, summary_data FROM workflow_results WHERE workflow_id = ?', (workflow_id,)).fetchone()
             conn.close()
             if result_row:
@@ -233,16 +236,21 @@ class WorkflowService:
     def update_workflow_results(self, workflow_id: str, updated_data: Dict):
         """Saves the updated results to the JSON file and database."""
         self._save_workflow_results(workflow_id, updated_data['matches'], updated_data['summary'], overwrite=True)
-        logging.info(f"Successfully updated results for workflow ID: {workflow_id}")
+        logging.info("Successfully updated results for workflow ID: %s", workflow_id)
 
     
     def get_all_workflows(self):
         workflows = WorkflowModel.get_all_workflows()
-        
+
+        # One directory listing instead of a stat call per workflow row.
+        try:
+            results_on_disk = set(os.listdir(self.results_dir))
+        except FileNotFoundError:
+            results_on_disk = set()
+
         for workflow in workflows:
-            results_file = os.path.join(self.results_dir, f"{workflow['id']}.json")
-            workflow['has_results'] = os.path.exists(results_file)
-        
+            workflow['has_results'] = f"{workflow['id']}.json" in results_on_disk
+
         return workflows
         
     def _generate_summary(self, items, comparison_mode):
@@ -304,45 +312,51 @@ class WorkflowService:
             if os.path.exists(results_file):
                 os.remove(results_file)
             
-            logging.info(f"Successfully deleted workflow and files for ID: {workflow_id}")
+            logging.info("Successfully deleted workflow and files for ID: %s", workflow_id)
             return {'success': True}
         except Exception as e:
-            logging.error(f"Failed to delete workflow {workflow_id}: {str(e)}")
+            logging.error("Failed to delete workflow %s: %s", workflow_id, e)
             raise Exception(f"Failed to delete workflow: {str(e)}")
 
-    def download_files_from_cloud(self, url: str) -> List[Dict]:
+    async def download_files_from_cloud_async(self, url: str) -> List[FileInfo]:
         """
         Placeholder function to simulate downloading files from a cloud storage URL.
         In a real application, this would use the appropriate SDK (e.g., for
         SharePoint or Google Drive) to authenticate and download files.
-        
-        Returns a list of dicts, with each dict containing 'filename' and 'path'.
+
+        All files are fetched concurrently so batch latency is bounded by the
+        slowest download rather than the sum of all of them.
+
+        Returns a list of FileInfo records with the filename and local path.
         """
-        logging.info(f"Simulating download from cloud URL: {url}")
-        
+        logging.info("Simulating download from cloud URL: %s", url)
+
         # --- Integration Point for Cloud SDKs ---
         # Example for SharePoint using MSAL:
         # 1. Use MSAL to get an access token.
         # 2. Use the Microsoft Graph API with the token to list and download files.
-        
+        #    Stream each file with httpx.AsyncClient:
+        #      async for chunk in resp.aiter_bytes(1 << 20): await f.write(chunk)
+
         # Example for Google Drive:
         # 1. Use Google API Client Library for Python to authenticate (OAuth2).
         # 2. Use the Drive API to list and download files from the folder.
-        
+
         # For demonstration, we'll create a couple of dummy files.
         simulated_dir = os.path.join(self.upload_dir, 'simulated_batch')
         os.makedirs(simulated_dir, exist_ok=True)
-        
+
         files_to_create = {
             "WI_document_batch_1.txt": "This is a test WI document.",
             "QC_document_batch_2.txt": "This is a test QC document."
         }
-        
-        downloaded_files = []
-        for filename, content in files_to_create.items():
+
+        async def _download_one(filename: str, content: str) -> FileInfo:
             file_path = os.path.join(simulated_dir, filename)
-            with open(file_path, 'w') as f:
-                f.write(content)
-            downloaded_files.append({'filename': filename, 'path': file_path})
-            
-        return downloaded_files
+            async with aiofiles.open(file_path, 'w') as f:
+                await f.write(content)
+            return FileInfo(filename=filename, path=file_path)
+
+        return list(await asyncio.gather(
+            *(_download_one(filename, content) for filename, content in files_to_create.items())
+        ))
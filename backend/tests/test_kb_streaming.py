@@ -0,0 +1,58 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+import httpx
+
+import main
+import models
+
+
+class TestKnowledgeBaseStreaming(unittest.TestCase):
+    def setUp(self):
+        # Point the models module at a throwaway database so the test doesn't
+        # touch the checked-in one.
+        self._tmp_dir = tempfile.mkdtemp()
+        self._orig_db_path = models.DB_PATH
+        models.DB_PATH = os.path.join(self._tmp_dir, 'test.db')
+        models.init_db()
+
+        for i in range(300):
+            models.KnowledgeBaseModel.add_item(
+                material_name=f'Material {i}',
+                part_number=f'PN-{i}'
+            )
+
+    def tearDown(self):
+        models.DB_PATH = self._orig_db_path
+        shutil.rmtree(self._tmp_dir)
+
+    def test_concurrent_large_limit_streams(self):
+        """Two streaming requests on one event loop must both complete.
+
+        Regression test: the streaming generator's SQLite connection used to
+        be created with check_same_thread=True, and the thread pool that
+        resumes the generator reassigns threads under contention, so a second
+        concurrent stream crashed mid-body with a ProgrammingError.
+        """
+        async def fetch_both():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                return await asyncio.gather(
+                    client.get('/api/knowledge-base?limit=300'),
+                    client.get('/api/knowledge-base?limit=300'),
+                )
+
+        for response in asyncio.run(fetch_both()):
+            self.assertEqual(response.status_code, 200)
+            payload = response.json()
+            self.assertTrue(payload['success'])
+            self.assertEqual(len(payload['items']), 300)
+
+
+if __name__ == '__main__':
+    unittest.main()